@@ -10,6 +10,7 @@ config = SimpleNamespace(**{
     "seed": 0,
     "dataset": "odinhg/gooaq-subset",
     "split": "train",
+    "dataset_cache_dir": "temp\\dataset_cache",
     "device": "cpu" if not torch.cuda.is_available() else "cuda",
     
     # Tokenizer config
@@ -34,6 +35,7 @@ config = SimpleNamespace(**{
     "dataloader_num_workers": 2,
     "lr": 1e-4,
     "num_epochs": 5,
+    "compile_model": True,
     "model_filename": "temp\\model.pth",
     "optimizer_filename": "temp\\optimizer.pth",
     })
@@ -1,18 +1,40 @@
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
 import torch
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, Sampler
 from datasets import load_dataset
+from tokenizers.processors import TemplateProcessing
+
+# Keep the Rust tokenizer's thread pool enabled even though the DataLoader
+# forks worker processes afterwards (tokenizers disables it by default then).
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "true")
+
+
+class BucketSampler(Sampler):
+    """
+    Batch sampler that groups sequences of similar length together, so each
+    batch only needs to be padded to its own longest sequence instead of the
+    global max_len. Batch order is reshuffled every epoch.
+    """
+    def __init__(self, lengths, batch_size, generator=None):
+        order = torch.argsort(torch.as_tensor(lengths))
+        self.batches = [order[i:i + batch_size].tolist() for i in range(0, len(order), batch_size)]
+        self.generator = generator
+
+    def __iter__(self):
+        for i in torch.randperm(len(self.batches), generator=self.generator):
+            yield self.batches[i]
+
+    def __len__(self):
+        return len(self.batches)
 
 class QADataset(Dataset):
     def __init__(
-        self, config, tokenizer, 
+        self, config, tokenizer,
     ):
-        self.dataset = load_dataset(config.dataset)[config.split]
-        n_subset = int(config.model_train_fraction * len(self.dataset))
-        self.dataset= self.dataset.select(range(n_subset))
-        print(
-            f"Loaded dataset of size {len(self.dataset)} with columns {self.dataset.column_names}"
-        )
-
         self.tokenizer = tokenizer
         self.max_length = config.max_len
 
@@ -21,38 +43,110 @@ class QADataset(Dataset):
         self.sep_id = self.tokenizer.token_to_id(config.sep_token)
         self.end_id = self.tokenizer.token_to_id(config.end_token)
 
-    def __len__(self):
-        return len(self.dataset)
-
-    def __getitem__(self, idx):
-        question, answer = self.dataset[idx]["question"], self.dataset[idx]["answer"]
-
-        # 1. Tokenize
-        question_ids = self.tokenizer.encode(question).ids
-        answer_ids = self.tokenizer.encode(answer).ids
-
-        # 2. Combine into full sequence with special tokens
-        full_sequence = question_ids + [self.sep_id] + answer_ids + [self.end_id]
-
-        # 3. Truncate/pad to max_length + 1
-        padded = full_sequence[:self.max_length + 1]  # Truncate if too long
-        if len(padded) < self.max_length + 1:
-            padded += [self.pad_id] * (self.max_length + 1 - len(padded))
-
-        padded = torch.tensor(padded)
+        # The tokenized corpus only depends on the dataset, the subset size,
+        # max_len and the tokenizer itself, so cache it on disk keyed by a hash
+        # of those. Repeat runs skip dataset loading and tokenization entirely.
+        cache_key = hashlib.sha1(
+            "|".join([
+                config.dataset,
+                config.split,
+                str(config.model_train_fraction),
+                str(self.max_length),
+                self.tokenizer.to_str(),
+            ]).encode()
+        ).hexdigest()[:16]
+        cache_path = Path(config.dataset_cache_dir) / f"qadataset_{cache_key}.npy"
+
+        if cache_path.exists():
+            print(f"Loading tokenized dataset from cache at {cache_path}")
+            buffer = np.load(cache_path, mmap_mode="r")
+        else:
+            buffer = self._tokenize_corpus(config)
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            np.save(cache_path, buffer)
+            print(f"Cached tokenized dataset to {cache_path}")
+
+        # Unpadded sequence lengths, used by BucketSampler and for trimming batches
+        self.lengths = torch.from_numpy((buffer != self.pad_id).sum(axis=1))
+
+        # Precompute source/target sequences and the padding mask for the whole
+        # corpus in a few vectorized ops, so __getitem__ does no per-item
+        # arithmetic at all. The buffers live in shared memory so that
+        # DataLoader workers index the same pages instead of serializing every
+        # sample over a pipe back to the main process. torch.tensor copies, so
+        # this also works on the read-only memory map from the cache.
+        buffer = torch.tensor(buffer).share_memory_()
+        self.source_sequences = buffer[:, :-1]
+        self.target_sequences = buffer[:, 1:].clone()
+        # With right-padded sequences and causal attention no real token can
+        # ever attend to a PAD key, and the PAD positions themselves are
+        # excluded from the loss via -100 — so batches do not need to carry a
+        # key_padding_mask, and attention can take the fused causal fast path.
+        self.target_sequences.masked_fill_(self.source_sequences.eq(self.pad_id), -100)  # Ignore loss on PAD
+        self.target_sequences.share_memory_()
+
+    def _tokenize_corpus(self, config):
+        """
+        Load the dataset and tokenize every (question, answer) pair into one
+        padded int32 matrix. Only runs when there is no cached artifact.
+        """
+        dataset = load_dataset(config.dataset)[config.split]
+        n_subset = int(config.model_train_fraction * len(dataset))
+        dataset = dataset.select(range(n_subset))
+        print(
+            f"Loaded dataset of size {len(dataset)} with columns {dataset.column_names}"
+        )
 
-        # 4. Create source and target sequences
-        source_sequence = padded[:-1]
-        target_sequence = padded[1:].clone()
-        target_sequence[source_sequence == self.pad_id] = -100  # Ignore loss on PAD
+        # Pull the columns out of the Arrow table once; plain Python lists are
+        # much cheaper to index than materializing an Arrow row per access.
+        questions = dataset["question"]
+        answers = dataset["answer"]
+
+        # Tokenize the whole corpus once up front instead of re-encoding every sample
+        # on every epoch. Each (question, answer) pair is encoded in a single Rust
+        # call and the post-processor splices in the SEP/END tokens for us, so no
+        # Python-side stitching of id lists is needed.
+        self.tokenizer.post_processor = TemplateProcessing(
+            single="$A",
+            pair=f"$A {config.sep_token} $B {config.end_token}",
+            special_tokens=[(config.sep_token, self.sep_id), (config.end_token, self.end_id)],
+        )
+        # Let the tokenizer truncate and pad in Rust as well, so every encoding
+        # comes back with exactly max_length + 1 ids and the Python pad loop
+        # disappears.
+        self.tokenizer.enable_truncation(max_length=self.max_length + 1)
+        self.tokenizer.enable_padding(pad_id=self.pad_id, pad_token=config.pad_token, length=self.max_length + 1)
+        print("Tokenizing dataset...")
+        encodings = self.tokenizer.encode_batch(list(zip(questions, answers)))
+
+        # Assemble all padded sequences into one matrix so that batching is pure
+        # array indexing. Every row already has exactly max_length + 1 ids, so
+        # this is a single C-level conversion with no per-row Python work.
+        # int32 is plenty for our vocabulary size and halves the bytes moved
+        # per batch compared to the int64 default; the model casts to long
+        # right before the embedding lookup.
+        return np.asarray([encoding.ids for encoding in encodings], dtype=np.int32)
 
-        # 5. Padding mask (True where PAD token is)
-        key_padding_mask = (source_sequence == self.pad_id)
+    def __len__(self):
+        return self.source_sequences.size(0)
 
+    def __getitem__(self, idx):
+        # Just hand the index to collate, which assembles the whole batch at once
+        return idx
+
+    def collate(self, batch):
+        """
+        Build a whole batch with one fancy-indexing op per key instead of
+        stacking per-sample tensors, trimmed to the longest sequence in the
+        batch. Pass as `collate_fn` to the DataLoader.
+        """
+        idx = torch.as_tensor(batch)
+        # Columns beyond the batch max length are PAD everywhere; with
+        # BucketSampler this shrinks most batches well below max_len.
+        seq_len = int(self.lengths[idx].max()) - 1
         return {
-            "source_sequence": source_sequence,
-            "target_sequence": target_sequence,
-            "key_padding_mask": key_padding_mask,
+            "source_sequence": self.source_sequences[idx, :seq_len],
+            "target_sequence": self.target_sequences[idx, :seq_len],
         }
 
 
@@ -67,15 +161,13 @@ if __name__ == "__main__":
     config.max_len = 64 # For testing purposes
     dataset = QADataset(config, tokenizer)
 
-    source, target, key_padding_mask = dataset[idx].values()
+    source, target = [t[0] for t in dataset.collate([idx]).values()]
 
     print("Source sequence shape:", source.shape)
     print("Target sequence shape:", target.shape)
-    print("Key padding mask shape:", key_padding_mask.shape)
 
     print("Source sequence:", source)
     print("Target sequence:", target)
-    print("Key padding mask:", key_padding_mask)
 
     decoded_source = tokenizer.decode(source.tolist(), skip_special_tokens=False)
     decoded_target = tokenizer.decode(target[target != -100].tolist(), skip_special_tokens=False)
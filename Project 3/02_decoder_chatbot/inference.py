@@ -1,3 +1,4 @@
+import numpy as np
 import torch
 import torch.nn.functional as F
 
@@ -63,7 +64,8 @@ def tokenize_input(tokenizer, text, sep_id):
     """
     tokens = tokenizer.encode(text).ids
     tokens = tokens + [sep_id]
-    return torch.tensor(tokens)
+    # from_numpy is a single memcpy; torch.tensor(list) type-checks per element
+    return torch.from_numpy(np.asarray(tokens, dtype=np.int64))
 
 def decode_output(tokenizer, tokens):
     """
@@ -1,12 +1,20 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import math
 
 class DecoderBlock(nn.Module):
     def __init__(self, embed_size, num_heads, dropout):
         super().__init__()
+        self.num_heads = num_heads
+        self.head_dim = embed_size // num_heads
+
         self.ln1 = nn.LayerNorm(embed_size)
-        self.attn = nn.MultiheadAttention(embed_dim=embed_size, num_heads=num_heads, batch_first=True)
+        # Explicit fused QKV projection + scaled_dot_product_attention instead
+        # of nn.MultiheadAttention: no internal q/k/v copies and a reliable
+        # dispatch to the fused flash/efficient attention kernels
+        self.qkv = nn.Linear(embed_size, 3 * embed_size)
+        self.proj = nn.Linear(embed_size, embed_size)
         self.dropout1 = nn.Dropout(dropout)
 
         self.ln2 = nn.LayerNorm(embed_size)
@@ -17,17 +25,16 @@ class DecoderBlock(nn.Module):
         )
         self.dropout2 = nn.Dropout(dropout)
 
-    def forward(self, x, attn_mask, padding_mask):
+    def forward(self, x):
+        batch_size, seq_len, embed_size = x.shape
+
         # Self-attention with residual and layer norm
         norm_x = self.ln1(x)
-        attn_output, _ = self.attn(
-            norm_x, norm_x, norm_x,
-            attn_mask=attn_mask,
-            key_padding_mask=padding_mask,
-            need_weights=False,
-            is_causal=True
-        )
-        x = x + self.dropout1(attn_output)
+        qkv = self.qkv(norm_x).reshape(batch_size, seq_len, 3, self.num_heads, self.head_dim).permute(2, 0, 3, 1, 4)
+        query, key, value = qkv.unbind(0)
+        attn_output = F.scaled_dot_product_attention(query, key, value, is_causal=True)
+        attn_output = attn_output.transpose(1, 2).reshape(batch_size, seq_len, embed_size)
+        x = x + self.dropout1(self.proj(attn_output))
 
         # Feedforward network with residual and layer norm
         norm_x = self.ln2(x)
@@ -55,9 +62,10 @@ class PositionalEncoding(nn.Module):
 
     def forward(self, x):
         # x shape: (batch_size, seq_len, embed_size)
+        # The buffer already lives on the right device (it moves with the
+        # module), so no per-forward .to(device) copy is needed
         seq_len = x.size(1)
-        pe = self.positional_encoding[:, :seq_len, :].to(x.device)
-        return x + pe
+        return x + self.positional_encoding[:, :seq_len, :]
 
 class TransformerModel(nn.Module):
     def __init__(self, config):
@@ -77,31 +85,19 @@ class TransformerModel(nn.Module):
         self.layers = nn.ModuleList([DecoderBlock(self.embed_size, self.num_heads, self.dropout_p) for _ in range(self.num_layers)])
         self.fc_out = nn.Linear(self.embed_size, self.vocab_size)
 
-        # Precompute the causal mask and positional encoding
-        self.register_buffer("causal_mask", self.generate_causal_mask(self.max_len))
-
-    def forward(self, x, padding_mask=None):
-        batch_size, seq_len = x.shape
-
-        # Use the precomputed causal mask (trim to match seq_len)
-        attn_mask = self.causal_mask[:seq_len, :seq_len]
-
-        # Embed and add positional encoding
-        x = self.embedding(x)
+    def forward(self, x):
+        # Embed and add positional encoding (tokens arrive as int32, cast once)
+        x = self.embedding(x.long())
         x = self.pos_encoder(x)
         x = self.dropout(x)
 
+        # Causal masking happens inside each block via is_causal=True, so no
+        # mask tensor needs to be built or sliced here
         for layer in self.layers:
-            x = layer(x, attn_mask, padding_mask)
+            x = layer(x)
 
         return self.fc_out(x)
 
-    def generate_causal_mask(self, seq_len):
-        """
-        Generates an upper triangular mask to prevent attending to future tokens.
-        """
-        return torch.triu(torch.ones(seq_len, seq_len), diagonal=1).bool()
-
 
 if __name__ == "__main__":
     from tokenizers import Tokenizer
@@ -117,17 +113,16 @@ if __name__ == "__main__":
     # Simple forward pass for sanity checking
     tokenizer = Tokenizer.from_file(config.tokenizer_filename)
     dataset = QADataset(config, tokenizer)
-    source = dataset[0]["source_sequence"].unsqueeze(0)
-    target = dataset[0]["target_sequence"].unsqueeze(0)
-    padding_mask = dataset[0]["key_padding_mask"].unsqueeze(0)
+    batch = dataset.collate([0])
+    source = batch["source_sequence"]
+    target = batch["target_sequence"]
 
     # Forward pass
-    out = model(source, padding_mask)
+    out = model(source)
     print("Output shape:", out.shape)
     print("Target shape:", target.shape)
-    print("Loss mask shape:", padding_mask.shape)
 
     # Calculate loss
-    loss = cross_entropy(out.transpose(1, 2), target)
+    loss = cross_entropy(out.transpose(1, 2), target.long())
     print("Loss:", loss.item())
 
@@ -3,16 +3,16 @@ from tokenizers import Tokenizer, models, pre_tokenizers, decoders, trainers, no
 from pathlib import Path
 from tqdm import tqdm
 
-def example_to_text(example):
-    return f"{example['question']} {example['answer']}"
-
 def train_tokenizer(config):
     # Load the training data and select a subset to train the tokenizer on
     dataset = load_dataset(config.dataset)[config.split]
 
-    # Concatenate the question and answer strings 
+    # Pull the columns out of the Arrow table once instead of materializing a
+    # row dict per example, then concatenate the question and answer strings
+    questions = dataset["question"]
+    answers = dataset["answer"]
     print("Combining strings...")
-    train_texts = [example_to_text(example) for example in tqdm(dataset)]
+    train_texts = [f"{question} {answer}" for question, answer in tqdm(zip(questions, answers), total=len(questions))]
 
     tokenizer = Tokenizer(models.BPE(unk_token=config.unk_token))
     tokenizer.normalizer = normalizers.BertNormalizer(clean_text=True, strip_accents=True)
@@ -7,10 +7,20 @@ from tokenizers import Tokenizer
 from pathlib import Path
 
 from model import TransformerModel
-from dataset import QADataset
+from dataset import QADataset, BucketSampler
 from utils import get_num_params, print_config
 
 
+def save_checkpoint(model, optimizer, config):
+    """
+    Save model and optimizer state dicts. The plain module's weights are saved
+    even when the model is compiled, so checkpoints load the same either way.
+    """
+    module = getattr(model, "_orig_mod", model)
+    torch.save(module.state_dict(), config.model_filename)
+    torch.save(optimizer.state_dict(), config.optimizer_filename)
+
+
 def train_model(config):
     """
     Train the model using the given configuration using the AdamW optimizer and cross-entropy loss. If training on GPU, mixed precision training is used to speed up training. Model and optimizer state dicts are saved every 500 batches and at the end of each epoch making it easy to continue training in case of a crash or interruption.
@@ -21,7 +31,6 @@ def train_model(config):
     model = TransformerModel(config)
     print(f"Number of parameters in the model: {get_num_params(model):,}")
     model = model.to(config.device)
-    #model = torch.compile(model)
     optimizer = optim.AdamW(model.parameters(), lr=config.lr)
 
     if (
@@ -34,14 +43,25 @@ def train_model(config):
             torch.load(config.optimizer_filename, weights_only=True)
         )
 
+    if config.compile_model:
+        # Compile after loading weights so the checkpoint keys match the plain
+        # module. Fuses embedding + positional encoding + dropout (and the MLP)
+        # into far fewer kernels; these ops are memory-bound, so fusion is the
+        # main win.
+        model = torch.compile(model)
+
     tokenizer = Tokenizer.from_file(config.tokenizer_filename)
     dataset = QADataset(config, tokenizer)
     train_loader = DataLoader(
         dataset,
-        batch_size=config.batch_size,
-        shuffle=True,
+        batch_sampler=BucketSampler(
+            dataset.lengths,
+            config.batch_size,
+            generator=torch.Generator().manual_seed(config.seed),
+        ),
         num_workers=config.dataloader_num_workers,
-        generator=torch.Generator().manual_seed(config.seed),
+        collate_fn=dataset.collate,
+        pin_memory=config.device == "cuda",
     )
 
     criterion = nn.CrossEntropyLoss(ignore_index=-100)
@@ -57,21 +77,22 @@ def train_model(config):
         ):
             optimizer.zero_grad()
 
-            source, target, key_padding_mask = batch.values()
-            source = source.to(config.device)
-            target = target.to(config.device)
-            key_padding_mask = key_padding_mask.to(config.device)
+            source, target = batch.values()
+            # non_blocking overlaps the host-to-device copy with compute when
+            # the batch comes from pinned memory
+            source = source.to(config.device, non_blocking=True)
+            target = target.to(config.device, non_blocking=True).long()  # cross_entropy expects int64 targets
 
-            if scaler is not None: 
+            if scaler is not None:
                 with torch.autocast("cuda"):
-                    out = model(source, padding_mask=key_padding_mask)
+                    out = model(source)
                     loss = criterion(out.transpose(1, 2), target)
 
                 scaler.scale(loss).backward()
                 scaler.step(optimizer)
                 scaler.update()
             else:
-                out = model(source, padding_mask=key_padding_mask)
+                out = model(source)
                 loss = criterion(out.transpose(1, 2), target)
                 loss.backward()
                 optimizer.step()
@@ -83,14 +104,12 @@ def train_model(config):
             )
 
             if (batch_idx + 1) % 500 == 0:  # Save checkpoint every 500 batches
-                torch.save(model.state_dict(), config.model_filename)
-                torch.save(optimizer.state_dict(), config.optimizer_filename)
+                save_checkpoint(model, optimizer, config)
 
         mean_epoch_loss = total_loss / len(train_loader)
         print(f"\nMean Epoch Cross-Entropy Loss: {mean_epoch_loss:.4f}")
 
-    torch.save(model.state_dict(), config.model_filename)
-    torch.save(optimizer.state_dict(), config.optimizer_filename)
+    save_checkpoint(model, optimizer, config)
 
     return model
 